@@ -1,43 +1,159 @@
+import math
+import wave
 import numpy as np
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, wait
 from io import BytesIO
-from scipy.io.wavfile import write
+from numba import njit, prange
 
 SAMPLE_RATE = 44100
 MAX_DURATION_MINUTES = 120
+BLOCK = SAMPLE_RATE
+TWO_PI = 2 * np.pi
+LUT_SIZE = 4096
+SIN_LUT = np.sin(TWO_PI * np.arange(LUT_SIZE + 1) / LUT_SIZE).astype(np.float32)
+CHOIR_DETUNES = np.array([0.997, 1.002, 0.995, 1.004, 0.998, 1.003, 0.996, 1.001])
+CHOIR_HARMONICS = ((1, 1.0), (2, 0.3), (3, 0.1))
 
-def generate_signal(signal_type, base_freq, secondary_freq, duration, amplitude=0.1):
-    t = np.linspace(0, duration, int(SAMPLE_RATE * duration))
+@njit(parallel=True, fastmath=True, nogil=True, cache=True)
+def to_pcm(signal, out):
+    # Scale, clip and cast to int16 in a single pass; out may be a strided channel view.
+    for i in prange(signal.shape[0]):
+        out[i] = min(max(signal[i] * 32767, -32768.0), 32767.0)
+
+@njit(fastmath=True, nogil=True, cache=True)
+def sine_osc(phase, omega, out):
+    # Two-tap recurrence y[n] = 2cos(w)y[n-1] - y[n-2], seeded from the block's start phase.
+    c = 2 * math.cos(omega)
+    y1 = math.sin(phase - omega)
+    y2 = math.sin(phase - 2 * omega)
+    for i in range(out.shape[0]):
+        y = c * y1 - y2
+        out[i] = y
+        y2 = y1
+        y1 = y
+
+@njit(fastmath=True, nogil=True, cache=True)
+def gated_osc(phase, omega, gate_phase, gate_omega, out):
+    c = 2 * math.cos(omega)
+    y1 = math.sin(phase - omega)
+    y2 = math.sin(phase - 2 * omega)
+    gc = 2 * math.cos(gate_omega)
+    g1 = math.sin(gate_phase - gate_omega)
+    g2 = math.sin(gate_phase - 2 * gate_omega)
+    for i in range(out.shape[0]):
+        y = c * y1 - y2
+        g = gc * g1 - g2
+        out[i] = y * (g > 0)
+        y2 = y1
+        y1 = y
+        g2 = g1
+        g1 = g
+
+def generate_binaural_beat(base_freq, delta_freq, duration):
+    total = int(SAMPLE_RATE * duration)
+    omega_left = TWO_PI * base_freq / SAMPLE_RATE
+    omega_right = TWO_PI * (base_freq + delta_freq) / SAMPLE_RATE
+    phase_left = phase_right = 0.0
+    left_buf, right_buf = np.empty(BLOCK, dtype=np.float32), np.empty(BLOCK, dtype=np.float32)
+    for start in range(0, total, BLOCK):
+        length = min(BLOCK, total - start)
+        left, right = left_buf[:length], right_buf[:length]
+        sine_osc(phase_left, omega_left, left)
+        sine_osc(phase_right, omega_right, right)
+        yield left, right
+        phase_left = (phase_left + omega_left * BLOCK) % TWO_PI
+        phase_right = (phase_right + omega_right * BLOCK) % TWO_PI
+
+def generate_isochronic(base_freq, beat_freq, duration):
+    total = int(SAMPLE_RATE * duration)
+    omega_carrier = TWO_PI * base_freq / SAMPLE_RATE
+    omega_mod = TWO_PI * beat_freq / SAMPLE_RATE
+    phase_carrier = phase_mod = 0.0
+    buf = np.empty(BLOCK, dtype=np.float32)
+    for start in range(0, total, BLOCK):
+        signal = buf[:min(BLOCK, total - start)]
+        gated_osc(phase_carrier, omega_carrier, phase_mod, omega_mod, signal)
+        yield signal, signal
+        phase_carrier = (phase_carrier + omega_carrier * BLOCK) % TWO_PI
+        phase_mod = (phase_mod + omega_mod * BLOCK) % TWO_PI
+
+@njit(fastmath=True, nogil=True, cache=True)
+def lut_sin(x):
+    # Table lookup with linear interpolation; well below 16-bit quantisation error.
+    u = x * (LUT_SIZE / TWO_PI)
+    k = math.floor(u)
+    i = int(k) & (LUT_SIZE - 1)
+    f = u - k
+    return SIN_LUT[i] + (SIN_LUT[i + 1] - SIN_LUT[i]) * f
+
+@st.cache_resource(show_spinner=False)
+def choir_kernel(n_voices, harmonics):
+    # Emit a kernel with the voice and harmonic loops unrolled and the harmonic weights as literals.
+    src = [
+        "def kernel(out, start, total, gain, carrier_steps, vib_steps, vib_depths, phase_carrier, phase_vib):",
+        "    for n in prange(out.shape[0]):",
+        "        env = 0.8 - 0.6 * (start + n) / max(total - 1, 1)",
+        "        s = 0.0",
+    ]
+    for i in range(n_voices):
+        src.append(f"        a = (phase_carrier[{i}] + carrier_steps[{i}] * n +"
+                   f" vib_depths[{i}] * lut_sin(phase_vib[{i}] + vib_steps[{i}] * n))")
+        src.append("        s += " + " + ".join(f"{weight!r} * lut_sin({k} * a)" for k, weight in harmonics))
+    src.append("        out[n] = gain * env * s")
+    namespace = {"prange": prange, "lut_sin": lut_sin}
+    exec("\n".join(src), namespace)
+    return njit(parallel=True, fastmath=True, nogil=True)(namespace["kernel"])
+
+def generate_choir(base_freq, duration):
+    total = int(SAMPLE_RATE * duration)
+    voices = np.arange(len(CHOIR_DETUNES))
+    # Per-sample phase increments, so the kernel never rebuilds 2*pi*f*t.
+    carrier_steps = TWO_PI * base_freq * (voices + 1) * 0.5 * CHOIR_DETUNES / SAMPLE_RATE
+    vib_steps = TWO_PI * (5 + 0.5 * voices) / SAMPLE_RATE
+    vib_depths = TWO_PI * (0.5 + 0.1 * voices)
+    phase_carrier = np.zeros(len(voices))
+    phase_vib = np.zeros(len(voices))
+    # Envelope tops out at 0.8 and the harmonic weights bound each voice,
+    # so this bounds the mix without a second pass over the signal.
+    gain = 1 / (len(voices) * 0.8 * sum(weight for _, weight in CHOIR_HARMONICS))
+    kernel = choir_kernel(len(voices), CHOIR_HARMONICS)
+    buf = np.empty(BLOCK, dtype=np.float32)
+    for start in range(0, total, BLOCK):
+        signal = buf[:min(BLOCK, total - start)]
+        kernel(signal, start, total, gain, carrier_steps, vib_steps, vib_depths,
+               phase_carrier, phase_vib)
+        phase_carrier = (phase_carrier + carrier_steps * BLOCK) % TWO_PI
+        phase_vib = (phase_vib + vib_steps * BLOCK) % TWO_PI
+        yield signal, signal
+
+def generate_signal(signal_type, base_freq, secondary_freq, duration):
+    # Generators reuse one buffer per channel, so each block is only valid until the next is requested.
     if signal_type == "binaural":
-        left = amplitude * np.sin(2 * np.pi * base_freq * t)
-        right = amplitude * np.sin(2 * np.pi * (base_freq + secondary_freq) * t)
-        return np.column_stack((left, right))
+        return generate_binaural_beat(base_freq, secondary_freq, duration)
     elif signal_type == "isochronic":
-        carrier = np.sin(2 * np.pi * base_freq * t)
-        mod = (np.sin(2 * np.pi * secondary_freq * t) > 0).astype(float)
-        signal = amplitude * carrier * mod
-        return np.column_stack((signal, signal))
+        return generate_isochronic(base_freq, secondary_freq, duration)
     elif signal_type == "choir":
-        voices = []
-        for i in range(8):
-            freq = base_freq * (i + 1) * 0.5
-            detune = 1 + (np.random.rand() * 0.02 - 0.01)
-            vib_depth = 0.5 + i * 0.1
-            vib_rate = 5 + i * 0.5
-            vib = np.sin(2 * np.pi * vib_rate * t) * vib_depth
-            env = np.linspace(0.8, 0.2, len(t))
-            voice = (amplitude * 0.5 * env * 
-                    (np.sin(2 * np.pi * (freq * detune + vib) * t) +
-                     0.3 * np.sin(2 * np.pi * 2 * (freq * detune + vib) * t) +
-                     0.1 * np.sin(2 * np.pi * 3 * (freq * detune + vib) * t)))
-            voices.append(voice)
-        signal = np.sum(voices, axis=0)
-        return np.column_stack((signal * 0.8, signal * 0.8))
-
-def create_audio_file(signal):
+        return generate_choir(base_freq, duration)
+
+def create_audio_file(blocks, on_block=None):
     audio_bytes = BytesIO()
-    scaled = np.int16(signal / np.max(np.abs(signal)) * 32767)
-    write(audio_bytes, SAMPLE_RATE, scaled)
+    with wave.open(audio_bytes, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        pcm_buf = np.empty((BLOCK, 2), dtype=np.int16)
+        for left, right in blocks:
+            # Channels arrive as separate float32 arrays and are only interleaved as int16.
+            pcm = pcm_buf[:len(left)]
+            to_pcm(left, pcm[:, 0])
+            if right is left:
+                pcm[:, 1] = pcm[:, 0]
+            else:
+                to_pcm(right, pcm[:, 1])
+            wav.writeframesraw(pcm)
+            if on_block is not None:
+                on_block(len(left))
     return audio_bytes.getvalue()
 
 PRESETS = {
@@ -50,6 +166,21 @@ PRESETS = {
     "Custom Configuration": {"type": "custom"}
 }
 
+@st.cache_resource
+def synth_executor():
+    # A single worker: the kernels already use every core, and this serialises Numba launches across sessions.
+    return ThreadPoolExecutor(max_workers=1)
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=8, show_spinner=False)
+def build_wav(preset_name, duration_seconds, custom_key=(), _on_block=None):
+    config = PRESETS[preset_name]
+    if config["type"] == "custom":
+        signal_type, base_freq, secondary_freq = custom_key
+    else:
+        signal_type, base_freq = config["type"], config["base"]
+        secondary_freq = config.get("delta") or config.get("beat")
+    return create_audio_file(generate_signal(signal_type, base_freq, secondary_freq, duration_seconds), _on_block)
+
 st.set_page_config(page_title="Healing Frequency Generator", page_icon="🎵", layout="centered")
 st.title("🎵 Healing Frequency Generator")
 st.markdown("Generate therapeutic sounds including Binaural Beats, Isochronic Tones, Angelic Choirs, and Sleep Assistance")
@@ -58,6 +189,8 @@ with st.sidebar:
     st.header("⚙️ Settings")
     preset = st.selectbox("Choose Preset", list(PRESETS.keys()))
     duration = st.slider("Duration (minutes)", 1, MAX_DURATION_MINUTES, 15)
+    if st.button("🗑️ Clear Cached Audio"):
+        st.cache_data.clear()
 
 duration_seconds = min(duration * 60, MAX_DURATION_MINUTES * 60)
 
@@ -68,22 +201,25 @@ if PRESETS[preset]["type"] == "custom":
             custom_type = st.radio("Sound Type", ["Binaural", "Isochronic", "Choir"])
         with col2:
             base_freq = st.number_input("Base Frequency (Hz)", 50, 1000, 432 if custom_type != "Choir" else 220)
+            secondary_freq = None
             if custom_type == "Binaural":
-                delta_freq = st.number_input("Delta Frequency (Hz)", 1, 30, 7)
+                secondary_freq = st.number_input("Delta Frequency (Hz)", 1, 30, 7)
             elif custom_type == "Isochronic":
-                beat_freq = st.number_input("Beat Frequency (Hz)", 0.1, 40.0, 10.0)
+                secondary_freq = st.number_input("Beat Frequency (Hz)", 0.1, 40.0, 10.0)
+    custom_key = (custom_type.lower(), base_freq, secondary_freq)
+else:
+    custom_key = ()
 
 if st.button("✨ Generate Audio"):
     with st.spinner(f"Generating {duration} minute audio..."):
         try:
-            config = PRESETS[preset] if PRESETS[preset]["type"] != "custom" else {"type": custom_type, "base": base_freq}
-            signal_type = config["type"]
-            if signal_type == "choir":
-                signal = generate_signal(signal_type, config["base"], None, duration_seconds)
-            else:
-                secondary_freq = config.get("delta") or config.get("beat")
-                signal = generate_signal(signal_type, config["base"], secondary_freq, duration_seconds)
-            audio_bytes = create_audio_file(signal)
+            rendered = []
+            future = synth_executor().submit(build_wav, preset, duration_seconds, custom_key, rendered.append)
+            progress = st.progress(0.0)
+            while wait([future], timeout=0.25).not_done:
+                progress.progress(min(sum(rendered) / (SAMPLE_RATE * duration_seconds), 1.0))
+            progress.empty()
+            audio_bytes = future.result()
             st.audio(audio_bytes, format="audio/wav")
             st.download_button(label="⬇️ Download WAV File", data=audio_bytes, file_name=f"healing_{preset.replace(' ', '_')}.wav", mime="audio/wav")
             st.success(f"✅ Successfully generated {preset} ({duration} minutes)")